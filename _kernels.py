@@ -0,0 +1,136 @@
+"""
+Compiled Speaker Assignment Kernels
+===================================
+
+Numba version of the per-word loop used by 'transcript_gen_logic.py':
+
+- merge_words: speaker assignment, smoothing and sentence grouping fused into one
+  pass over the words (match_word does the segment lookup for a single word).
+
+It is exposed in two forms:
+
+1. JIT: 'merge_words_jit', compiled on first use and cached on disk (cache=True),
+   so later runs only load the cached machine code.
+2. AOT: running `python _kernels.py` builds the 'speaker_kernels' extension module
+   next to this file, which needs no compilation at all when imported. It embeds a
+   hash of this file ('source_hash'), so a build left over from an older version of
+   the kernels is detected and ignored; rebuild it after editing this file.
+
+'transcript_gen_logic.py' prefers the AOT module, then the JIT kernels, then its
+own numpy implementation.
+"""
+
+import hashlib
+import os
+import sys
+
+import numpy as np
+from numba import njit
+
+# numba.pycc is only needed to build the AOT module. It is deprecated, so it is not
+# imported otherwise: importing it warns, and once removed the JIT kernels must still load.
+cc = None
+# Hash of this file baked into the AOT module (see source_hash); only set when building
+SOURCE_HASH = 0
+if __name__ == "__main__":
+    try:
+        from numba.pycc import CC
+    except ImportError:
+        sys.exit("numba.pycc is not available in this numba version; the JIT kernels will be used instead.")
+    cc = CC("speaker_kernels")
+    cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+    # Must match transcript_gen_logic._kernels_source_hash
+    with open(os.path.abspath(__file__), "rb") as f:
+        SOURCE_HASH = int(hashlib.sha1(f.read()).hexdigest()[:15], 16)
+
+
+def export(exported_name, sig):
+    """cc.export when building the AOT module, a no-op otherwise."""
+    if cc is None:
+        return lambda func: func
+    return cc.export(exported_name, sig)
+
+
+@njit(cache=True, nogil=True)
+def bisect_left(a, x):
+    lo, hi = 0, a.shape[0]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if a[mid] < x:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+@njit(cache=True, nogil=True)
+def bisect_right(a, x):
+    lo, hi = 0, a.shape[0]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if x < a[mid]:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+@njit(cache=True, nogil=True)
+def match_word(word_start, word_end, starts, reach):
+    word_mid = (word_start + word_end) / 2
+    idx = bisect_right(starts, word_mid) - 1
+
+    # 1. Exact match (midpoint inside segment)
+    if idx >= 0:
+        first = bisect_left(reach, word_mid)
+        if first <= idx:
+            return first
+
+    # 2. Closest match
+    closest = -1
+    min_dist = np.inf
+    if idx >= 0:
+        min_dist = max(word_start - reach[idx], 0.0)
+        closest = bisect_left(reach, min(word_start, reach[idx]))
+    if idx + 1 < starts.shape[0]:
+        if max(starts[idx + 1] - word_end, 0.0) < min_dist:
+            closest = idx + 1
+    return closest
+
+
+@export("source_hash", "i8()")
+def source_hash():
+    """Hash of the _kernels.py the AOT module was built from (frozen at compile time)."""
+    return SOURCE_HASH
+
+
+@export("merge_words", "UniTuple(i8[:], 3)(f8[:], f8[:], f8[:], f8[:], i2[:], f8)")
+def merge_words(word_starts, word_ends, starts, reach, speaker_ids, max_gap):
+    """See transcript_gen_logic._merge_words."""
+    n_words = word_starts.shape[0]
+    group_speakers = np.empty(n_words, np.int64)
+    group_starts = np.empty(n_words, np.int64)
+    group_ends = np.empty(n_words, np.int64)
+    n_groups = 0
+    speaker = -1
+    for i in range(n_words):
+        # Smoothing: a word close to the previous one keeps its speaker, so the
+        # segment lookup is only needed at run starts
+        if i == 0 or not (word_starts[i] - word_ends[i - 1] < max_gap):
+            new_speaker = speaker_ids[match_word(word_starts[i], word_ends[i], starts, reach)]
+            if i == 0 or new_speaker != speaker:
+                if n_groups > 0:
+                    group_ends[n_groups - 1] = i
+                speaker = new_speaker
+                group_speakers[n_groups] = speaker
+                group_starts[n_groups] = i
+                n_groups += 1
+    if n_groups > 0:
+        group_ends[n_groups - 1] = n_words
+    return group_speakers[:n_groups], group_starts[:n_groups], group_ends[:n_groups]
+
+
+merge_words_jit = njit(cache=True, nogil=True)(merge_words)
+
+if __name__ == "__main__":
+    cc.compile()
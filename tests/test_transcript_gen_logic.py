@@ -0,0 +1,117 @@
+import glob
+import importlib.util
+import os
+import random
+import shutil
+import subprocess
+import sys
+import types
+
+import pytest
+
+import transcript_gen_logic as tgl
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def reference_transcript(word_timestamps, speaker_segments):
+    """The original linear-scan assignment, smoothing and grouping, kept as the spec."""
+    segments = tgl.filter_short_segments(speaker_segments)
+
+    def get_speaker(word_start, word_end):
+        word_mid = (word_start + word_end) / 2
+        for seg in segments:
+            if seg['start'] <= word_mid <= seg['end']:
+                return seg['speaker']
+        closest_speaker = "Unknown"
+        min_dist = float('inf')
+        for seg in segments:
+            dist = 0
+            if word_end < seg['start']:
+                dist = seg['start'] - word_end
+            elif word_start > seg['end']:
+                dist = word_start - seg['end']
+            if dist < min_dist:
+                min_dist = dist
+                closest_speaker = seg['speaker']
+        return closest_speaker
+
+    word_speakers = [
+        {"word": w['word'], "start": w['start'], "end": w['end'],
+         "speaker": get_speaker(w['start'], w['end'])}
+        for w in word_timestamps
+    ]
+    for i in range(1, len(word_speakers)):
+        if word_speakers[i]['start'] - word_speakers[i - 1]['end'] < 0.25:
+            word_speakers[i]['speaker'] = word_speakers[i - 1]['speaker']
+
+    final_transcript = []
+    for item in word_speakers:
+        if final_transcript and final_transcript[-1]["speaker"] == item['speaker']:
+            final_transcript[-1]["words"].append(item['word'])
+        else:
+            final_transcript.append({"speaker": item['speaker'], "words": [item['word']]})
+    return [{"speaker": line["speaker"], "text": " ".join(line["words"])} for line in final_transcript]
+
+
+def random_case(rng):
+    # Segments in start order, as pyannote emits them; overlaps and gaps included
+    segments = []
+    for i in range(rng.randint(0, 10)):
+        start = round(rng.uniform(0, 30), 1)
+        segments.append({
+            "start": start,
+            "end": start + round(rng.uniform(0, 5), 1),
+            "speaker": f"SPEAKER_0{i % 3}",
+        })
+    segments.sort(key=lambda s: s['start'])
+
+    words = []
+    t = rng.uniform(-1, 2)
+    for k in range(rng.randint(0, 60)):
+        t += round(rng.uniform(0, 0.6), 2)
+        duration = round(rng.uniform(0, 0.5), 2)
+        words.append({"word": f"w{k}", "start": t, "end": t + duration})
+        t += duration
+    return words, segments
+
+
+def assert_matches_reference(monkeypatch, merge_words, n_cases=500):
+    monkeypatch.setattr(tgl, "_merge_words", merge_words)
+    rng = random.Random(1234)
+    for _ in range(n_cases):
+        words, segments = random_case(rng)
+        assert tgl.build_transcript(words, segments) == reference_transcript(words, segments)
+
+
+def test_numpy_matches_reference(monkeypatch):
+    assert_matches_reference(monkeypatch, tgl._merge_words_numpy)
+
+
+def test_jit_matches_reference(monkeypatch):
+    pytest.importorskip("numba")
+    from _kernels import merge_words_jit
+    assert_matches_reference(monkeypatch, merge_words_jit)
+
+
+def test_aot_matches_reference(monkeypatch, tmp_path):
+    pytest.importorskip("numba")
+    shutil.copy(os.path.join(REPO_DIR, "_kernels.py"), tmp_path)
+    build = subprocess.run([sys.executable, "_kernels.py"], cwd=tmp_path, capture_output=True)
+    built = glob.glob(str(tmp_path / "speaker_kernels*"))
+    if build.returncode != 0 or not built:
+        pytest.skip(f"could not build the AOT module: {build.stderr.decode()[-500:]}")
+
+    spec = importlib.util.spec_from_file_location("speaker_kernels", built[0])
+    speaker_kernels = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(speaker_kernels)
+
+    assert tgl._aot_kernels_current(speaker_kernels)
+    assert_matches_reference(monkeypatch, speaker_kernels.merge_words)
+
+
+def test_stale_aot_module_is_rejected():
+    current = tgl._kernels_source_hash()
+    assert not tgl._aot_kernels_current(types.SimpleNamespace(source_hash=lambda: current + 1))
+    # Builds from before the hash was embedded have no source_hash at all
+    assert not tgl._aot_kernels_current(types.SimpleNamespace())
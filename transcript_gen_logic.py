@@ -8,7 +8,8 @@ smooth speaker assignment:
 
 1. Data Loading:
    - Loads 'transcription.json' (ASR words with accurate timestamps).
-   - Loads 'diarization.json' (Speaker segments with start/end times).
+   - Loads 'diarization.json' (Speaker segments with start/end times, in start order
+     as pyannote emits them).
 
 2. Segment Filtering:
    - Removes diarization segments shorter than 0.3 seconds.
@@ -16,14 +17,16 @@ smooth speaker assignment:
      speaker flipping artifacts.
 
 3. Initial Speaker Assignment (Word-Level):
-   - Iterates through each word from the ASR output.
-   - Assigns a speaker using 'Nearest Neighbor' logic:
+   - Assigns a speaker to every word from the ASR output in one vectorized pass.
+   - Uses 'Nearest Neighbor' logic:
      a. Exact Match: If the word's midpoint falls strictly within a speaker segment.
      b. Nearest Neighbor: If the word falls in a gap (silence/noise), assigns it to 
         the temporally closest speaker segment to prevent "[Unknown]" labels.
+   - When several segments qualify (overlapping speech, equal distances), the one
+     that starts first wins.
 
 4. Speaker Smoothing:
-   - Iterates through the list of assigned speakers.
+   - Works on the whole list of assigned speakers at once.
    - Checks the gap between the current word and the previous word.
    - If the gap is less than 0.25 seconds, the current word is forced to match the 
      previous speaker.
@@ -36,114 +39,247 @@ smooth speaker assignment:
    - Saves to 'final_transcript.txt'.
 """
 
+import hashlib
 import json
+import os
+import secrets
+import warnings
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def read_json(path):
+    if orjson is not None:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(path, "r") as f:
+        return json.load(f)
+
+def write_atomic(path, data):
+    """
+    Writes data (str or bytes) through a 1 MiB buffer to a temp file, then moves it
+    over path so readers never see a half-written file.
+    """
+    # A uniquely named temp file next to the target, so concurrent writers don't collide
+    # and os.replace stays on the same filesystem. open(..., "x") creates it with the
+    # usual umask-based permissions, unlike tempfile's owner-only files.
+    tmp_path = f"{path}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+    try:
+        with open(tmp_path, "xb" if isinstance(data, bytes) else "x", buffering=1 << 20) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        # Don't leave the temp file behind if the write or the rename failed
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_json(path, data):
+    if orjson is not None:
+        write_atomic(path, orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+    else:
+        write_atomic(path, json.dumps(data, indent=2))
 
 def load_data():
-    with open("./artifacts/transcription.json", "r") as f:
-        transcription = json.load(f)
-    with open("./artifacts/diarization.json", "r") as f:
-        diarization = json.load(f)
+    transcription = read_json("./artifacts/transcription.json")
+    diarization = read_json("./artifacts/diarization.json")
     return transcription, diarization
 
+# Speaker id for words that could not be matched to any segment
+UNKNOWN_SPEAKER = -1
+
 def filter_short_segments(segments, threshold=0.3):
     return [s for s in segments if (s['end'] - s['start']) >= threshold]
 
-def get_speaker_improved(word_start, word_end, segments):
+def build_segment_index(segments):
+    """
+    Builds a lookup structure over the speaker segments, computed once per transcript.
+    Segments are expected in start order, as pyannote emits them; they are
+    stable-sorted by start time anyway, so when several segments match a word the
+    earliest-starting one wins (for unsorted input this can differ from the
+    first-listed one). They are stored as parallel arrays. 'reach' is the
+    running maximum of the segment ends, which lets overlapping segments be searched
+    with a binary search as well.
+    Speakers are encoded as small ints ('speaker_ids'); 'speaker_labels' maps them
+    back to the diarization labels.
     """
-    Finds the speaker for the word.
+    n_segments = len(segments)
+    starts = np.fromiter((s['start'] for s in segments), dtype=np.float64, count=n_segments)
+    ends = np.fromiter((s['end'] for s in segments), dtype=np.float64, count=n_segments)
+    speaker_labels = sorted({s['speaker'] for s in segments})
+    speaker_to_id = {label: i for i, label in enumerate(speaker_labels)}
+    speaker_ids = np.fromiter((speaker_to_id[s['speaker']] for s in segments), dtype=np.int16, count=n_segments)
+
+    order = np.argsort(starts, kind='stable')
+    starts, ends, speaker_ids = starts[order], ends[order], speaker_ids[order]
+    reach = np.maximum.accumulate(ends) if n_segments else ends
+    return starts, ends, speaker_ids, reach, speaker_labels
+
+def speaker_label(speaker_id, speaker_labels):
+    return speaker_labels[speaker_id] if speaker_id != UNKNOWN_SPEAKER else "Unknown"
+
+def _match_segments(word_starts, word_ends, starts, reach):
+    """
+    Returns the index of the segment each word is assigned to, in one vectorized pass.
     1. Checks if the word's midpoint is within a segment.
     2. If not, finds the closest segment in time.
+    Both lookups are binary searches over the output of build_segment_index.
     """
-    word_mid = (word_start + word_end) / 2
-    
+    word_mids = (word_starts + word_ends) / 2
+
+    # Last segment starting at or before each midpoint
+    idx = np.searchsorted(starts, word_mids, side='right') - 1
+    has_left = idx >= 0
+    has_right = idx + 1 < len(starts)
+    left = np.clip(idx, 0, len(starts) - 1)
+    right = np.clip(idx + 1, 0, len(starts) - 1)
+
     # 1. Exact match (midpoint inside segment)
-    for seg in segments:
-        if seg['start'] <= word_mid <= seg['end']:
-            return seg['speaker']
-            
+    # The first segment whose end reaches the midpoint; it contains the midpoint
+    # as long as it also starts before it.
+    first = np.searchsorted(reach, word_mids, side='left')
+    inside = has_left & (first <= idx)
+
     # 2. Closest match
-    closest_speaker = "Unknown"
-    min_dist = float('inf')
-    
-    for seg in segments:
-        # Calculate distance from word interval to segment interval
-        # if word is before segment: dist = seg.start - word.end
-        # if word is after segment: dist = word.start - seg.end
-        
-        dist = 0
-        if word_end < seg['start']:
-            dist = seg['start'] - word_end
-        elif word_start > seg['end']:
-            dist = word_start - seg['end']
-        else:
-            # Overlap case (should have been caught above by midpoint, but logic might vary)
-            dist = 0
-            
-        if dist < min_dist:
-            min_dist = dist
-            closest_speaker = seg['speaker']
-            
-    return closest_speaker
+    # Only two candidates remain: the furthest-reaching segment that started before
+    # the word, and the first segment starting after the midpoint.
+    left_reach = reach[left]
+    d_left = np.where(has_left, np.maximum(word_starts - left_reach, 0), np.inf)
+    d_right = np.where(has_right, np.maximum(starts[right] - word_ends, 0), np.inf)
+    closest_left = np.searchsorted(reach, np.minimum(word_starts, left_reach), side='left')
+    closest = np.where(d_right < d_left, right, closest_left)
+
+    return np.where(inside, first, closest)
+
+def _run_starts(word_starts, word_ends, max_gap):
+    """
+    Returns, for every word, the index of the first word of its run of closely
+    spaced words (gap below max_gap), forward-filled with np.maximum.accumulate.
+    """
+    gaps = word_starts[1:] - word_ends[:-1]
+    run_start = np.concatenate(([True], ~(gaps < max_gap)))
+    return np.maximum.accumulate(np.where(run_start, np.arange(len(word_starts)), 0))
+
+def _merge_words_numpy(word_starts, word_ends, starts, reach, speaker_ids, max_gap):
+    """
+    Assigns, smooths and groups the words into sentences. Returns the speaker id,
+    first word index and end word index (exclusive) of every sentence.
+    """
+    w_speakers = speaker_ids[_match_segments(word_starts, word_ends, starts, reach)]
+    w_speakers = smooth_speakers(word_starts, word_ends, w_speakers, max_gap)
+    # A new sentence starts wherever the speaker changes
+    boundaries = np.flatnonzero(np.diff(w_speakers)) + 1
+    group_starts = np.concatenate(([0], boundaries))
+    group_ends = np.append(boundaries, len(word_starts))
+    return w_speakers[group_starts], group_starts, group_ends
+
+def _kernels_source_hash():
+    """
+    Hash of the _kernels.py next to this file, or None if it is missing. Must match
+    the SOURCE_HASH that _kernels.py bakes into the AOT module.
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_kernels.py")
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return int(hashlib.sha1(f.read()).hexdigest()[:15], 16)
+
+def _aot_kernels_current(module):
+    """Whether an AOT speaker_kernels module was built from the current _kernels.py."""
+    expected = _kernels_source_hash()
+    if expected is None:
+        # Deployed without the kernel source: nothing to compare against
+        return True
+    return hasattr(module, "source_hash") and module.source_hash() == expected
+
+_merge_words = _merge_words_numpy
+try:
+    # Ahead-of-time compiled kernels, built with `python _kernels.py`
+    import speaker_kernels
+except ImportError:
+    speaker_kernels = None
+if speaker_kernels is not None and not _aot_kernels_current(speaker_kernels):
+    warnings.warn(
+        "speaker_kernels was built from an older _kernels.py and is ignored; "
+        "rebuild it with `python _kernels.py`."
+    )
+    speaker_kernels = None
+if speaker_kernels is not None:
+    _merge_words = speaker_kernels.merge_words
+else:
+    try:
+        # Same kernels JIT-compiled by numba (cached on disk after the first run)
+        from _kernels import merge_words_jit as _merge_words
+    except ImportError:
+        # numba is not installed: keep the numpy version
+        pass
+
+def smooth_speakers(word_starts, word_ends, speakers, max_gap=0.25):
+    """
+    Forces each word to the previous word's speaker when the gap between them is
+    below max_gap. Every run of closely spaced words therefore takes the speaker of
+    its first word.
+    Smoothing can only change something at a speaker change with a small gap, so
+    the gaps are checked there first and the full pass is skipped if there is none.
+    """
+    if len(speakers) == 0:
+        return speakers
+    changes = np.flatnonzero(speakers[1:] != speakers[:-1]) + 1
+    if not np.any(word_starts[changes] - word_ends[changes - 1] < max_gap):
+        return speakers
+    return speakers[_run_starts(word_starts, word_ends, max_gap)]
+
+def merge_speakers(word_starts, word_ends, segment_index, max_gap=0.25):
+    """
+    Runs speaker assignment, smoothing and sentence grouping in a single pass over
+    the words (one fused loop when the compiled kernels are available).
+    Returns (speaker_ids, group_starts, group_ends): one entry per sentence, where
+    words[group_starts[k]:group_ends[k]] were spoken by speaker_ids[k].
+    """
+    starts, ends, speaker_ids, reach, _ = segment_index
+    n_words = len(word_starts)
+    if n_words == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    if len(starts) == 0:
+        return np.array([UNKNOWN_SPEAKER]), np.array([0]), np.array([n_words])
+    return _merge_words(word_starts, word_ends, starts, reach, speaker_ids, max_gap)
+
+def build_transcript(word_timestamps, speaker_segments):
+    """
+    Merges ASR words and diarization segments into speaker-attributed sentences:
+    [{"speaker": ..., "text": ...}, ...]
+    """
+    speaker_segments = filter_short_segments(speaker_segments)
+    segment_index = build_segment_index(speaker_segments)
+
+    # Word data is kept as parallel columns: float arrays for the times, a list for the words
+    n_words = len(word_timestamps)
+    w_starts = np.fromiter((w.get('start', w.get('start_offset', 0)) for w in word_timestamps),
+                           dtype=np.float64, count=n_words)
+    w_ends = np.fromiter((w.get('end', w.get('end_offset', 0)) for w in word_timestamps),
+                         dtype=np.float64, count=n_words)
+    w_words = [w['word'] for w in word_timestamps]
+
+    # Steps 1-3: Assign speakers, smooth them (Gap < 0.25s => conform to previous)
+    # and group consecutive words of the same speaker into sentences
+    group_speakers, group_starts, group_ends = merge_speakers(w_starts, w_ends, segment_index)
+    speaker_labels = segment_index[-1]
+    return [
+        {"speaker": speaker_label(speaker, speaker_labels), "text": " ".join(w_words[lo:hi])}
+        for speaker, lo, hi in zip(group_speakers.tolist(), group_starts.tolist(), group_ends.tolist())
+    ]
 
 def generate_transcript():
     transcription, speaker_segments = load_data()
-    speaker_segments = filter_short_segments(speaker_segments)
-    word_timestamps = transcription.get('timestamps', [])
-    
-    # Step 1: Assign initial speakers
-    word_speakers = []
-    for word_data in word_timestamps:
-        w_start = word_data.get('start', word_data.get('start_offset', 0))
-        w_end = word_data.get('end', word_data.get('end_offset', 0))
-        speaker = get_speaker_improved(w_start, w_end, speaker_segments)
-        word_speakers.append({
-            "word": word_data['word'],
-            "start": w_start,
-            "end": w_end,
-            "speaker": speaker
-        })
-        
-    # Step 2: Smooth speakers (Gap < 0.1s => conform to previous)
-    for i in range(1, len(word_speakers)):
-        prev = word_speakers[i-1]
-        curr = word_speakers[i]
-        
-        # Gap calculation
-        gap = curr['start'] - prev['end']
-        
-        if gap < 0.25:
-            curr['speaker'] = prev['speaker']
-            
-    # Step 3: Build final transcript
-    final_transcript = []
-    current_speaker = None
-    current_sentence = []
-
-    for item in word_speakers:
-        speaker = item['speaker']
-        word = item['word']
-        
-        if speaker != current_speaker:
-            if current_speaker is not None:
-                final_transcript.append({
-                    "speaker": current_speaker,
-                    "text": " ".join(current_sentence)
-                })
-            current_speaker = speaker
-            current_sentence = [word]
-        else:
-            current_sentence.append(word)
-
-    if current_sentence:
-        final_transcript.append({
-            "speaker": current_speaker,
-            "text": " ".join(current_sentence)
-        })
+    final_transcript = build_transcript(transcription.get('timestamps', []), speaker_segments)
 
     # Save Final Transcript
-    with open("final_transcript.txt", "w") as f:
-        for line in final_transcript:
-            f.write(f"[{line['speaker']}]: {line['text']}\n")
+    write_atomic("final_transcript.txt", "".join(f"[{line['speaker']}]: {line['text']}\n" for line in final_transcript))
     print("\nSaved to final_transcript.txt")
         
 if __name__ == "__main__":
@@ -1,11 +1,17 @@
 
 import os
-import json
+import sys
+import hashlib
+import select
+import contextlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 import torch
+import torchaudio
 import nemo.collections.asr as nemo_asr
 from pyannote.audio import Pipeline
-from pydub import AudioSegment
 from huggingface_hub import login
+from transcript_gen_logic import build_transcript, write_atomic, write_json
 
 HF_TOKEN = "hf_..." 
 
@@ -14,168 +20,286 @@ login(token=HF_TOKEN)
 
 # Check GPU
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print(f"Using device: {device}")
+# With a second GPU, diarization gets its own device so it can overlap with ASR
+diarization_device = torch.device("cuda:1") if torch.cuda.device_count() > 1 else device
+print(f"Using device: {device} (diarization: {diarization_device})")
 
+# Let cuDNN benchmark and pick the fastest convolution kernels. Audio lengths differ per
+# file, so it re-tunes once for every new input shape; that search is short next to
+# transcribing minutes of audio, which then runs on the faster kernels.
+torch.backends.cudnn.benchmark = True
+# Half precision for ASR inference on GPU; bfloat16 where the GPU supports it
+asr_dtype = torch.bfloat16 if device.type == "cuda" and torch.cuda.is_bf16_supported() else torch.float16
 
-video_filename = "video.mp4" 
-audio_filename = "./artifacts/extracted_audio.wav"
 
-if os.path.exists(video_filename):
-    # Extract audio using pydub/ffmpeg
-    print(f"Extracting audio from {video_filename}...")
-    audio = AudioSegment.from_file(video_filename)
-    # Convert to mono 16kHz wav (ideal for ASR/Diarization)
-    audio = audio.set_channels(1).set_frame_rate(16000)
-    audio.export(audio_filename, format="wav")
-    print(f"Audio saved to {audio_filename}")
-else:
-    print(f"Error: {video_filename} not found. Please upload it to the Files tab.")
+def cuda_stream(dev):
+    """Runs the enclosed work on a dedicated CUDA stream of dev (no-op on CPU)."""
+    if dev.type != "cuda":
+        return contextlib.nullcontext()
+    return torch.cuda.stream(torch.cuda.Stream(device=dev))
 
 
+# Models are loaded once and stay resident for every processed file
 print("Loading ASR Model...")
 asr_model = nemo_asr.models.ASRModel.from_pretrained(model_name="nvidia/parakeet-tdt-0.6b-v3")
 asr_model = asr_model.to(device)
 
-print("Transcribing...")
-# Transcribe with timestamps=True to get word-level timing
-hypotheses = asr_model.transcribe([audio_filename], timestamps=True)
+print("Loading Diarization Pipeline...")
+pipeline = Pipeline.from_pretrained(
+    "pyannote/speaker-diarization-3.1"
+).to(diarization_device)
 
-# Extract text and timestamps
-transcript_text = hypotheses[0].text
-timestamps = hypotheses[0].timestamp
+# Upper bound on the total audio duration (seconds) sent to the ASR model in one batch
+ASR_BATCH_SECONDS = 1200
 
-word_timestamps = timestamps.get('word', [])
-print(f"Transcription Complete. Found {len(word_timestamps)} words.")
-if word_timestamps:
-    print(f"Sample: {word_timestamps[:3]}")
 
+def transcribe_many(audio_files, batch_seconds=ASR_BATCH_SECONDS):
+    """
+    Transcribes several audio files in batches.
+    Files are sorted by duration and grouped into buckets whose total duration stays
+    under batch_seconds, so every batch holds clips of similar length.
+    Returns {audio_file: (text, timestamps)}. A file that fails is reported and left
+    out of the result; a failing batch is retried one file at a time.
+    """
+    durations = {}
+    for path in audio_files:
+        try:
+            info = torchaudio.info(path)
+        except Exception as e:
+            print(f"Error reading {path}: {e}")
+            continue
+        durations[path] = info.num_frames / info.sample_rate
 
-# Save Transcription Output
-transcription_output = {
-    "text": transcript_text,
-    "timestamps": word_timestamps
-}
-with open("./artifacts/transcription.json", "w") as f:
-    json.dump(transcription_output, f, indent=4)
-print("Transcription output saved to transcription.json")
+    buckets = []
+    bucket, bucket_seconds = [], 0.0
+    for path in sorted(durations, key=durations.get):
+        if bucket and bucket_seconds + durations[path] > batch_seconds:
+            buckets.append(bucket)
+            bucket, bucket_seconds = [], 0.0
+        bucket.append(path)
+        bucket_seconds += durations[path]
+    if bucket:
+        buckets.append(bucket)
 
+    results = {}
+
+    def transcribe_bucket(bucket):
+        # Transcribe with timestamps=True to get word-level timing
+        hypotheses = asr_model.transcribe(bucket, batch_size=len(bucket), timestamps=True)
+        for path, hypothesis in zip(bucket, hypotheses):
+            results[path] = (hypothesis.text, hypothesis.timestamp)
+
+    for bucket in buckets:
+        try:
+            transcribe_bucket(bucket)
+        except Exception as e:
+            if len(bucket) == 1:
+                print(f"Error transcribing {bucket[0]}: {e}")
+                continue
+            # Find the file(s) at fault and keep the rest
+            print(f"Error transcribing a batch of {len(bucket)} files, retrying one at a time: {e}")
+            for path in bucket:
+                try:
+                    transcribe_bucket([path])
+                except Exception as e:
+                    print(f"Error transcribing {path}: {e}")
+    return results
+
+
+def extract_audio(video_filename, audio_filename):
+    # Extract audio with ffmpeg
+    print(f"Extracting audio from {video_filename}...")
+    # Convert to mono 16kHz wav (ideal for ASR/Diarization)
+    subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", "-i", video_filename,
+         "-ac", "1", "-ar", "16000", "-f", "wav", audio_filename],
+        check=True,
+    )
+    print(f"Audio saved to {audio_filename}")
+
+
+def diarize(audio_filename):
+    # Pass the waveform already on the device so pyannote doesn't re-read the file on CPU
+    waveform, sample_rate = torchaudio.load(audio_filename)
+    waveform = waveform.to(diarization_device)
+    diarization_result = pipeline({"waveform": waveform, "sample_rate": sample_rate})
+
+    # Store segments in a list for easy processing
+    # Format: {'start': float, 'end': float, 'speaker': str}
+    speaker_segments = []
+    for turn, _, speaker in diarization_result.itertracks(yield_label=True):
+        if turn.end - turn.start < 0.3:
+             continue
+        speaker_segments.append({
+            "start": turn.start,
+            "end": turn.end,
+            "speaker": speaker
+        })
+    return speaker_segments
 
-print("Loading Diarization Pipeline...")
-pipeline = Pipeline.from_pretrained(
-    "pyannote/speaker-diarization-3.1"
-).to(device)
-
-print("Diarizing (this may take a moment)...")
-diarization_result = pipeline(audio_filename)
-
-# Store segments in a list for easy processing
-# Format: {'start': float, 'end': float, 'speaker': str}
-speaker_segments = []
-for turn, _, speaker in diarization_result.itertracks(yield_label=True):
-    if turn.end - turn.start < 0.3:
-         continue
-    speaker_segments.append({
-        "start": turn.start,
-        "end": turn.end,
-        "speaker": speaker
-    })
-
-# Save Diarization Output
-with open("./artifacts/diarization.json", "w") as f:
-    json.dump(speaker_segments, f, indent=4)
-print("Diarization output saved to diarization.json")
-print(f"Diarization Complete. Found {len(speaker_segments)} segments.")
-
-
-def get_speaker_for_word(word_start, word_end, segments):
-    """Finds the speaker active during the word's timeframe."""
-    word_mid = (word_start + word_end) / 2
-    
-    # 1. Exact match (midpoint inside segment)
-    for seg in segments:
-        if seg['start'] <= word_mid <= seg['end']:
-            return seg['speaker']
-            
-    # 2. Closest match
-    closest_speaker = "Unknown"
-    min_dist = float('inf')
-    
-    for seg in segments:
-        # Calculate distance from word interval to segment interval
-        dist = 0
-        if word_end < seg['start']:
-            dist = seg['start'] - word_end
-        elif word_start > seg['end']:
-            dist = word_start - seg['end']
-        
-        if dist < min_dist:
-            min_dist = dist
-            closest_speaker = seg['speaker']
-            
-    return closest_speaker
-
-final_transcript = []
-current_speaker = None
-current_sentence = []
-
-# Loop through all words from ASR
-word_speakers = []
-for word_data in word_timestamps:
-    word = word_data['word']
-    w_start = word_data['start']
-    w_end = word_data['end']
-    
-    # Identify speaker
-    speaker = get_speaker_for_word(w_start, w_end, speaker_segments)
-    word_speakers.append({
-        "word": word,
-        "start": w_start,
-        "end": w_end,
-        "speaker": speaker
-    })
-
-# Smooth speakers (Gap < 0.25s => conform to previous)
-for i in range(1, len(word_speakers)):
-    prev = word_speakers[i-1]
-    curr = word_speakers[i]
-    
-    # Gap calculation
-    gap = curr['start'] - prev['end']
-    
-    if gap < 0.25:
-        curr['speaker'] = prev['speaker']
-
-# Build Final Transcript
-for item in word_speakers:
-    speaker = item['speaker']
-    word = item['word']
-    
-    # If speaker changes, push the previous sentence and start a new one
-    if speaker != current_speaker:
-        if current_speaker is not None:
-            final_transcript.append({
-                "speaker": current_speaker,
-                "text": " ".join(current_sentence)
-            })
-        current_speaker = speaker
-        current_sentence = [word]
-    else:
-        current_sentence.append(word)
 
-# Append the last sentence
-if current_sentence:
-    final_transcript.append({
-        "speaker": current_speaker,
-        "text": " ".join(current_sentence)
-    })
+def save_outputs(artifacts_dir, transcript_text, timestamps, speaker_segments):
+    word_timestamps = timestamps.get('word', [])
+    print(f"Transcription Complete. Found {len(word_timestamps)} words.")
+    if word_timestamps:
+        print(f"Sample: {word_timestamps[:3]}")
 
+    # Save Transcription Output
+    transcription_output = {
+        "text": transcript_text,
+        "timestamps": word_timestamps
+    }
+    write_json(os.path.join(artifacts_dir, "transcription.json"), transcription_output)
+    print("Transcription output saved to transcription.json")
 
-print("\n=== FINAL TRANSCRIPT ===\n")
-for line in final_transcript:
-    print(f"[{line['speaker']}]: {line['text']}")
+    # Save Diarization Output
+    write_json(os.path.join(artifacts_dir, "diarization.json"), speaker_segments)
+    print("Diarization output saved to diarization.json")
+    print(f"Diarization Complete. Found {len(speaker_segments)} segments.")
 
-# Save Final Transcript
-with open("./artifacts/final_transcript.txt", "w") as f:
+    # Assign speakers to words, smooth and group them into sentences
+    final_transcript = build_transcript(word_timestamps, speaker_segments)
+
+    print("\n=== FINAL TRANSCRIPT ===\n")
     for line in final_transcript:
-        f.write(f"[{line['speaker']}]: {line['text']}\n")
-print("\nSaved to final_transcript.txt")
+        print(f"[{line['speaker']}]: {line['text']}")
+
+    # Save Final Transcript
+    write_atomic(
+        os.path.join(artifacts_dir, "final_transcript.txt"),
+        "".join(f"[{line['speaker']}]: {line['text']}\n" for line in final_transcript),
+    )
+    print("\nSaved to final_transcript.txt")
+
+
+def process_many(videos):
+    """
+    Runs the full pipeline for a batch of videos: extract audio -> transcribe + diarize -> merge.
+    videos is a list of (video_filename, artifacts_dir) pairs. All extracted audio files
+    go through the ASR model together (see transcribe_many); diarization and the merge
+    run per file. A failure affects only its own video: it is reported and the
+    other videos are still processed.
+    """
+    jobs = []
+    for video_filename, artifacts_dir in videos:
+        if not os.path.exists(video_filename):
+            print(f"Error: {video_filename} not found. Please upload it to the Files tab.")
+            continue
+        os.makedirs(artifacts_dir, exist_ok=True)
+        audio_filename = os.path.join(artifacts_dir, "extracted_audio.wav")
+        try:
+            extract_audio(video_filename, audio_filename)
+        except Exception as e:
+            print(f"Error extracting audio from {video_filename}: {e}")
+            continue
+        jobs.append((video_filename, artifacts_dir, audio_filename))
+    if not jobs:
+        return
+    audio_files = [audio_filename for _, _, audio_filename in jobs]
+
+    def run_asr():
+        with cuda_stream(device), torch.inference_mode(), \
+                torch.autocast(device_type=device.type, dtype=asr_dtype, enabled=device.type == "cuda"):
+            return transcribe_many(audio_files)
+
+    def run_diarization():
+        diarizations = {}
+        with cuda_stream(diarization_device):
+            for audio_filename in audio_files:
+                try:
+                    diarizations[audio_filename] = diarize(audio_filename)
+                except Exception as e:
+                    print(f"Error diarizing {audio_filename}: {e}")
+        return diarizations
+
+    # ASR and diarization don't depend on each other until the merge, so run them concurrently
+    print("Transcribing and diarizing (this may take a moment)...")
+    num_threads = torch.get_num_threads()
+    if device.type == "cuda":
+        # Keep CPU threads from competing with the GPU work
+        torch.set_num_threads(1)
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            asr_future = executor.submit(run_asr)
+            diarization_future = executor.submit(run_diarization)
+            transcriptions = asr_future.result()
+            diarizations = diarization_future.result()
+    finally:
+        torch.set_num_threads(num_threads)
+
+    for video_filename, artifacts_dir, audio_filename in jobs:
+        if audio_filename not in transcriptions or audio_filename not in diarizations:
+            print(f"Error: skipping {video_filename}, its transcription or diarization failed.")
+            continue
+        # Extract text and timestamps
+        transcript_text, timestamps = transcriptions[audio_filename]
+        try:
+            save_outputs(artifacts_dir, transcript_text, timestamps, diarizations[audio_filename])
+        except Exception as e:
+            print(f"Error saving outputs for {video_filename}: {e}")
+
+
+def process(video_filename, artifacts_dir="./artifacts"):
+    """Runs the full pipeline for one video; outputs are written to artifacts_dir."""
+    process_many([(video_filename, artifacts_dir)])
+
+
+def worker_artifacts_dir(video_path):
+    """
+    Artifacts directory for a video processed by the worker: the file name (with its
+    extension) plus a short hash of the absolute path, so 'a/talk.mp4', 'b/talk.mp4'
+    and 'talk.mkv' never share a directory.
+    """
+    path_hash = hashlib.sha1(os.path.abspath(video_path).encode()).hexdigest()[:8]
+    return os.path.join("./artifacts", f"{os.path.basename(video_path)}-{path_hash}")
+
+
+# Maximum number of videos the worker transcribes as one batch
+WORKER_BATCH_SIZE = 16
+
+
+def stdin_batches(max_size=WORKER_BATCH_SIZE):
+    """
+    Yields batches of up to max_size video paths read from stdin (one per line).
+    A batch only holds lines that are already available: the worker blocks for input
+    only when it has nothing to do, so a lone path is processed straight away.
+    """
+    fd = sys.stdin.fileno()
+    buffer = b""
+    paths = []
+    eof = False
+    while True:
+        # Wait for input only if nothing is pending; otherwise just drain what is ready
+        if not eof and select.select([fd], [], [], None if not paths else 0)[0]:
+            chunk = os.read(fd, 1 << 16)
+            if chunk:
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                paths.extend(line.decode().strip() for line in lines if line.strip())
+                if len(paths) < max_size:
+                    continue
+            else:
+                eof = True
+                if buffer.strip():
+                    paths.append(buffer.decode().strip())
+        if not paths:
+            if eof:
+                return
+            continue
+        yield paths[:max_size]
+        paths = paths[max_size:]
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv[1:]:
+        # Persistent worker: one video path per line on stdin, models stay loaded.
+        # Paths that arrive together are processed as one batch (see stdin_batches),
+        # each video getting its own artifacts directory (see worker_artifacts_dir).
+        for batch in stdin_batches():
+            videos = [(path, worker_artifacts_dir(path)) for path in batch]
+            try:
+                process_many(videos)
+            except Exception as e:
+                print(f"Error processing {', '.join(batch)}: {e}")
+    else:
+        process("video.mp4")